@@ -1,12 +1,21 @@
 import streamlit as st
-from hubspot import HubSpot
-from agno.models.openai import OpenAIChat
-import openai
-import os
-import requests
 from sidebar import render_sidebar
 from streamlit_local_storage import LocalStorage
 import json
+import hashlib
+
+try:
+    import orjson
+
+    def _dumps_keys(api_keys):
+        return orjson.dumps(api_keys, option=orjson.OPT_SORT_KEYS).decode()
+
+    _loads_keys = orjson.loads
+except ImportError:
+    def _dumps_keys(api_keys):
+        return json.dumps(api_keys, sort_keys=True)
+
+    _loads_keys = json.loads
 
 st.title("Hubspot CRM Initialization")
 
@@ -16,25 +25,31 @@ with st.sidebar:
 
 localS = LocalStorage()
 
-# On page load, try to get both keys from a single dict in local storage
-api_keys_str = localS.getItem("api_keys")
-if api_keys_str is None:
-    api_keys = {}
-else:
-    try:
-        api_keys = json.loads(api_keys_str)
-    except Exception:
-        api_keys = {}
+# On first page load, try to get both keys from a single dict in local storage.
+# Once a value has come back from the browser it is kept in session state, so later
+# reruns skip the component round trip.
+if '_stored_api_keys' not in st.session_state:
+    api_keys_str = localS.getItem("api_keys")
+    if api_keys_str is not None:
+        try:
+            st.session_state['_stored_api_keys'] = _loads_keys(api_keys_str)
+        except Exception:
+            st.session_state['_stored_api_keys'] = {}
+        # Normalized copy of what the browser holds, used to skip redundant writes
+        st.session_state['_api_keys_blob'] = _dumps_keys(st.session_state['_stored_api_keys'])
+api_keys = st.session_state.get('_stored_api_keys', {})
 openai_api_key = api_keys.get('openai_api_key', st.session_state.get('openai_api_key', ''))
 hubspot_api_key = api_keys.get('hubspot_api_key', st.session_state.get('hubspot_api_key', ''))
 
-# API Key entry fields on the main page
+# API Key entry fields on the main page.
+# Inside a form, typing in the fields does not trigger a rerun; only submitting does.
 st.write("#### Enter your API keys below:")
-openai_api_key = st.text_input("OpenAI API Key", value=openai_api_key, type="password")
-hubspot_api_key = st.text_input("HubSpot API Key", value=hubspot_api_key, type="password")
+with st.form("api_keys_form"):
+    openai_api_key = st.text_input("OpenAI API Key", value=openai_api_key, type="password")
+    hubspot_api_key = st.text_input("HubSpot API Key", value=hubspot_api_key, type="password")
 
-# Add notes for HubSpot API Key requirements
-st.markdown("""
+    # Add notes for HubSpot API Key requirements
+    st.markdown("""
 **Notes:**
 - The API keys are stored in your browser's local storage and in the session state. They will persist across sessions in this browser.
 - The HubSpot API key must be a **private app access token**.
@@ -48,17 +63,27 @@ st.markdown("""
     - `crm.objects.contacts.read`
 """)
 
-# Add submit button for API keys
-submitted = st.button("Submit API Keys", type="primary")
+    # Add submit button for API keys
+    submitted = st.form_submit_button("Submit API Keys", type="primary")
 
 # Only update session state and run validation after submit
 if submitted:
+    # Deferred until submit: these imports are slow and not needed to render the form
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    from utils import check_openai_api_key, get_account_details, hash_api_key
+
     # Save both keys in a single dict in local storage (as JSON string)
     api_keys = {
         'openai_api_key': openai_api_key,
         'hubspot_api_key': hubspot_api_key
     }
-    localS.setItem("api_keys", json.dumps(api_keys))
+    # Only write when the keys changed, to avoid a component round trip on repeat submits
+    api_keys_blob = _dumps_keys(api_keys)
+    if api_keys_blob != st.session_state.get('_api_keys_blob'):
+        localS.setItem("api_keys", api_keys_blob)
+        st.session_state['_api_keys_blob'] = api_keys_blob
+    st.session_state['_stored_api_keys'] = api_keys
     # Save to session state
     st.session_state['openai_api_key'] = openai_api_key
     st.session_state['hubspot_api_key'] = hubspot_api_key
@@ -68,23 +93,31 @@ if submitted:
         st.error("Please enter both OpenAI and HubSpot API keys above.")
         st.stop()
 
-    # Set the OpenAI API key from session state
-    os.environ["OPENAI_API_KEY"] = st.session_state['openai_api_key']
-
-    # Initialize HubSpot client
-    hubspot_client = HubSpot(access_token=st.session_state['hubspot_api_key'])
+    # Skip the network checks when this exact pair of keys was already validated this session
+    keys_hash = hashlib.blake2b(
+        f"{st.session_state['openai_api_key']}|{st.session_state['hubspot_api_key']}".encode(),
+        digest_size=16,
+    ).digest()
+    if st.session_state.get('_validated_hash') == keys_hash:
+        st.success("API keys already validated.")
+        st.stop()
 
-    # Get account details from HubSpot API
-    url = "https://api.hubapi.com/account-info/v3/details"
-    headers = {
-        'accept': "application/json",
-        'authorization': f"Bearer {st.session_state['hubspot_api_key']}"
-    }
+    # Both validations are independent network calls, so run them concurrently.
+    # Streamlit calls stay on the script thread; the workers only do I/O.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        account_future = executor.submit(
+            get_account_details,
+            hash_api_key(st.session_state['hubspot_api_key']),
+            st.session_state['hubspot_api_key'],
+        )
+        openai_future = executor.submit(
+            check_openai_api_key,
+            hash_api_key(st.session_state['openai_api_key']),
+            st.session_state['openai_api_key'],
+        )
 
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        account_details = response.json()
+        account_details = account_future.result()
         # st.write("### Hubspot Account Details")
         # st.json(account_details)
         st.success("Hubspot API key is valid.")
@@ -94,25 +127,18 @@ if submitted:
         st.session_state['portal_id'] = account_details.get('portalId')
         
         st.info(f"Saved to session: uiDomain = {st.session_state['ui_domain']}, portalId = {st.session_state['portal_id']}")
+        hubspot_valid = True
         
     except requests.exceptions.RequestException as e:
         st.error(f"Error fetching account details: {str(e)}")
-
-    # Check and validate OpenAI API key
-    # Function to check OpenAI API key validity
-    def check_openai_api_key(api_key):
-        client = openai.OpenAI(api_key=api_key)
-        try:
-            client.models.list()
-        except openai.AuthenticationError:
-            return False
-        else:
-            return True
+        hubspot_valid = False
 
     # Validate OpenAI API key
     try:
-        if check_openai_api_key(st.session_state['openai_api_key']):
+        if openai_future.result():
             st.success("OpenAI API key is valid.")
+            if hubspot_valid:
+                st.session_state['_validated_hash'] = keys_hash
         else:
             st.error("Invalid OpenAI API key. Please check your API key and try again.")
             st.stop()
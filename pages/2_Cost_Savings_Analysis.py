@@ -1,14 +1,14 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from hubspot import HubSpot
-import openai
-import requests
+import numpy as np
+import io
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from concurrent.futures import ThreadPoolExecutor
 from sidebar import render_sidebar
 import datetime
-from datetime import datetime, timedelta
-import pytz
-from utils import get_all_meeting_links, get_all_engagements
+from datetime import datetime, timedelta, timezone
+from utils import clear_fetch_caches, get_all_meeting_links, get_all_engagements, get_hubspot_session, hash_api_key
 
 st.title("💰 Cost Savings Analysis")
 
@@ -73,43 +73,45 @@ if not st.session_state.get('openai_api_key') or not st.session_state.get('hubsp
     st.error("Please configure your API keys in the Initialization page first.")
     st.stop()
 
-# Initialize clients
-hubspot_client = HubSpot(access_token=st.session_state['hubspot_api_key'])
-openai_client = openai.OpenAI(api_key=st.session_state['openai_api_key'])
+# User properties requested from HubSpot; the analysis only ever uses these columns
+USER_PROPERTIES = [
+    "hs_last_activity_time",
+    "hs_assigned_seats",
+    "hs_calendar_connection_status",
+    "hs_connected_email_status",
+    "hs_email",
+    "hs_invite_accepted_time",
+    "hs_invite_email_status",
+    "hs_invite_status",
+    "hs_searchable_calculated_name",
+    "hs_internal_user_id",
+    "hubspot_owner_id",
+    "hs_deactivated",
+]
+USER_HISTORY_PROPERTIES = [
+    "hs_invite_email_status",
+    "hs_invite_status",
+]
+REQUIRED_COLS = USER_PROPERTIES + [f"{key}_timestamp" for key in USER_HISTORY_PROPERTIES]
 
-# Function to get all users with pagination
-def get_all_users(hubspot_api_key):
+# Function to get all users with pagination (cached per token so reruns don't re-page HubSpot).
+# Keyed by a hash of the token; the raw token is underscore-prefixed so Streamlit does not hash it.
+@st.cache_data(ttl=600, show_spinner=False)
+def get_all_users(api_key_hash, _hubspot_api_key):
     all_users = []
     url = "https://api.hubapi.com/crm/v3/objects/users"
+    # Cursor paging can't be fetched ahead in parallel, so use the largest page
+    # size the endpoint allows to minimise sequential round trips
     params = {
-        "limit": 50,
-        "properties": [
-            "hs_last_activity_time",
-            "hs_assigned_seats", 
-            "hs_calendar_connection_status",
-            "hs_connected_email_status",
-            "hs_email",
-            "hs_invite_accepted_time", 
-            "hs_invite_email_status",
-            "hs_invite_status",
-            "hs_searchable_calculated_name",
-            "hs_internal_user_id",
-            "hubspot_owner_id",
-            "hs_deactivated",
-        ],
-        "propertiesWithHistory": [
-            "hs_invite_email_status",
-            "hs_invite_status"
-        ]
+        "limit": 100,
+        "properties": USER_PROPERTIES,
+        "propertiesWithHistory": USER_HISTORY_PROPERTIES
     }
     
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {hubspot_api_key}"
-    }
+    headers = {"Authorization": f"Bearer {_hubspot_api_key}"}
     
     while True:
-        response = requests.get(url, params=params, headers=headers)
+        response = get_hubspot_session().get(url, params=params, headers=headers, timeout=30)
         response.raise_for_status()
         data = response.json()
         
@@ -125,31 +127,35 @@ def get_all_users(hubspot_api_key):
 
 # Function to clean User data into DataFrame
 def clean_user_data(users):
-    cleaned_data = []
+    # Fill preallocated column arrays directly rather than one dict per user, so pandas
+    # doesn't have to transpose rows into columns. Timestamps stay as strings here and
+    # are parsed in one vectorized pass by identify_underutilization.
+    columns = {col: np.empty(len(users), dtype=object) for col in REQUIRED_COLS}
+    property_columns = [(key, columns[key]) for key in USER_PROPERTIES]
+    history_columns = [(key, columns[f"{key}_timestamp"]) for key in USER_HISTORY_PROPERTIES]
     
-    for user in users:
-        # Start with the basic properties
-        user_data = user["properties"].copy()
+    for i, user in enumerate(users):
+        properties = user["properties"]
+        for key, column in property_columns:
+            column[i] = properties.get(key)
         
         # Handle propertiesWithHistory
-        if "propertiesWithHistory" in user:
-            history_data = user["propertiesWithHistory"]
-            
-            # Loop through all keys in propertiesWithHistory
-            for key in history_data:
-                if history_data[key]:  # If the array is not empty
-                    # Take the first (latest) entry from the history
-                    latest_entry = history_data[key][0]
-                    user_data[f"{key}_timestamp"] = latest_entry["timestamp"]
-                else:
-                    # If the array is empty, set timestamp to null
-                    user_data[f"{key}_timestamp"] = None
-        
-        cleaned_data.append(user_data)
+        history_data = user.get("propertiesWithHistory", {})
+        for key, column in history_columns:
+            history = history_data.get(key)
+            # Take the first (latest) entry from the history, or null if the array is empty
+            column[i] = history[0]["timestamp"] if history else None
     
-    users_df = pd.DataFrame(cleaned_data)
+    users_df = pd.DataFrame(columns, copy=False)
     return users_df
 
+# Serialize the analysis for download with Arrow's multithreaded CSV writer.
+# Called once per analysis; the bytes are kept with the result in session state.
+def analysis_to_csv(df):
+    buffer = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buffer)
+    return buffer.getvalue()
+
 # Function to identify underutilization
 def identify_underutilization(users_df, skip_low_priority=False):
     """
@@ -163,13 +169,20 @@ def identify_underutilization(users_df, skip_low_priority=False):
     Returns:
         pd.DataFrame: DataFrame with additional underutilization columns
     """
-    df = users_df.copy()
-    
     # Filter out deactivated users
-    df = df[df['hs_deactivated'] != 'true']
+    df = users_df[users_df['hs_deactivated'] != 'true']
+    
+    # Seat-type masks, computed once and reused by every seat-based check below
+    seats = df['hs_assigned_seats'].fillna('').str.lower()
+    has_sales = seats.str.contains('sales', regex=False)
+    has_service = seats.str.contains('service', regex=False)
+    has_sales_or_service = has_sales | has_service
     
     # Filter to only include users with sales or service seats
-    df = df[df['hs_assigned_seats'].str.contains('sales|service', case=False, na=False)]
+    # (copy only the rows that survive filtering, since flag columns are added below)
+    df = df[has_sales_or_service].copy()
+    has_sales = has_sales[has_sales_or_service]
+    has_service = has_service[has_sales_or_service]
     
     # Convert timestamp columns to datetime
     timestamp_columns = [
@@ -179,21 +192,15 @@ def identify_underutilization(users_df, skip_low_priority=False):
         'hs_invite_status_timestamp'
     ]
     
+    # utc=True localizes naive values and converts aware ones to UTC in the same pass
     for col in timestamp_columns:
         if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
+            df[col] = pd.to_datetime(df[col], errors='coerce', utc=True, format='ISO8601')
     
     # Get current time in UTC for comparison (HubSpot timestamps are in UTC)
-    utc = pytz.UTC
-    current_time = datetime.now(utc)
+    current_time = datetime.now(timezone.utc)
     thirty_days_ago = current_time - timedelta(days=30)
     
-    # Ensure all timestamps are timezone-aware (UTC)
-    for col in timestamp_columns:
-        if col in df.columns:
-            # If timestamp is naive, localize to UTC, otherwise convert to UTC
-            df[col] = df[col].apply(lambda x: utc.localize(x) if x is not None and x.tzinfo is None else x)
-    
     # 🔴 HIGH PRIORITY REMOVAL TARGETS
     
     # 1. Users inactive for 30+ days
@@ -227,82 +234,86 @@ def identify_underutilization(users_df, skip_low_priority=False):
     
     if skip_low_priority:
         # Skip low priority review - set all flags to False
-        df['no_recent_engagements'] = False
-        df['sales_no_meeting_links'] = False
-        df['redundant_seat_combination'] = False
+        df['no_recent_engagements'] = np.zeros(len(df), dtype=bool)
+        df['sales_no_meeting_links'] = np.zeros(len(df), dtype=bool)
+        df['redundant_seat_combination'] = np.zeros(len(df), dtype=bool)
     else:
-        # 5. Sales and Service seat holders with no recent engagements (30+ days)
-        # Fetch engagements from the last 30 days and match to users
         engagement_status_text = st.empty()
         engagement_status_text.info("Fetching engagement data for low priority analysis...")
+        meeting_status_text = st.empty()
+        meeting_status_text.info("Fetching meeting links data for low priority analysis...")
+        
+        # Engagements and meeting links are independent pulls, so fetch them concurrently.
+        # Results (and any errors) are handled below on the script thread.
+        hubspot_api_key = st.session_state['hubspot_api_key']
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            engagements_future = executor.submit(get_all_engagements, hubspot_api_key, days_back=30)
+            meeting_links_future = executor.submit(get_all_meeting_links, hubspot_api_key)
+        
+        # 5. Sales and Service seat holders with no recent engagements (30+ days)
+        # Match engagements from the last 30 days to users
         try:
-            engagements = get_all_engagements(st.session_state['hubspot_api_key'], days_back=30)
+            engagements = engagements_future.result()
             
             if engagements:
-                # Extract owner IDs from engagements
-                users_with_engagements = set()
-                for engagement in engagements:
-                    engagement_data = engagement.get('engagement', {})
-                    owner_id = engagement_data.get('ownerId')
-                    if owner_id is not None and pd.notnull(owner_id) and str(owner_id).strip() != "":
-                        users_with_engagements.add(str(owner_id))
+                # Extract owner IDs from engagements in a single pass, as a sorted array of
+                # unique int64 so the membership test below can binary-search it
+                owner_ids = pd.Series([engagement.get('engagement', {}).get('ownerId') for engagement in engagements])
+                users_with_engagements = np.unique(pd.to_numeric(owner_ids, errors='coerce').dropna().to_numpy(dtype=np.int64))
                 
                 # Mark sales and service users without recent engagements
-                df['no_recent_engagements'] = (
-                    (df['hs_assigned_seats'].str.contains('sales|service', case=False, na=False)) &
-                    (~df['hubspot_owner_id'].isin(users_with_engagements))
-                )
+                # (every remaining row holds a sales or service seat)
+                has_engagement = np.zeros(len(df), dtype=bool)
+                user_owner_ids = pd.to_numeric(df['hubspot_owner_id'], errors='coerce').to_numpy(dtype=np.float64)
+                valid = ~np.isnan(user_owner_ids)
+                if len(users_with_engagements) and valid.any():
+                    valid_ids = user_owner_ids[valid].astype(np.int64)
+                    idx = np.searchsorted(users_with_engagements, valid_ids).clip(max=len(users_with_engagements) - 1)
+                    has_engagement[valid] = users_with_engagements[idx] == valid_ids
+                df['no_recent_engagements'] = ~has_engagement
                 
                 engagement_status_text.success(f"Successfully analyzed {len(engagements)} engagements from last 30 days. Found {len(users_with_engagements)} users with recent engagements.")
             else:
                 engagement_status_text.warning("No engagements found in last 30 days. Setting all sales/service users as having no recent engagements.")
-                df['no_recent_engagements'] = df['hs_assigned_seats'].str.contains('sales|service', case=False, na=False).astype(bool)
+                df['no_recent_engagements'] = np.ones(len(df), dtype=bool)
                 
         except Exception as e:
             st.error(f"Error fetching engagements: {str(e)}")
-            df['no_recent_engagements'] = pd.Series([False] * len(df), index=df.index)
+            df['no_recent_engagements'] = np.zeros(len(df), dtype=bool)
         
         # 6. Sales seat holders with no meeting links
-        # Fetch meeting links and join with users
-        meeting_status_text = st.empty()
-        meeting_status_text.info("Fetching meeting links data for low priority analysis...")
+        # Join meeting links with users
         try:
-            meeting_links = get_all_meeting_links(st.session_state['hubspot_api_key'])
+            meeting_links = meeting_links_future.result()
             
             if meeting_links:
-                # Convert meeting links to DataFrame
-                meeting_links_df = pd.DataFrame(meeting_links)
-                
-                # Create a set of user IDs who have meeting links
-                users_with_meeting_links = set()
-                for _, row in meeting_links_df.iterrows():
-                    organizer_id = row.get('organizerUserId')
-                    if organizer_id is not None and pd.notnull(organizer_id) and str(organizer_id).strip() != "":
-                        users_with_meeting_links.add(organizer_id)
+                # Create a set of user IDs who have meeting links straight from the raw records
+                organizer_ids = (meeting_link.get('organizerUserId') for meeting_link in meeting_links)
+                users_with_meeting_links = {
+                    organizer_id for organizer_id in organizer_ids
+                    if organizer_id is not None and str(organizer_id).strip()
+                }
                 
                 # Mark sales users without meeting links
                 df['sales_no_meeting_links'] = (
-                    (df['hs_assigned_seats'].str.contains('sales', case=False, na=False)) &
+                    has_sales &
                     (~df['hs_internal_user_id'].isin(users_with_meeting_links))
                 )
                 
                 meeting_status_text.success(f"Successfully analyzed {len(meeting_links)} meeting links. Found {len(users_with_meeting_links)} users with meeting links.")
             else:
                 meeting_status_text.warning("No meeting links found. Setting all sales users as having no meeting links.")
-                df['sales_no_meeting_links'] = df['hs_assigned_seats'].str.contains('sales', case=False, na=False).astype(bool)
+                df['sales_no_meeting_links'] = has_sales
                 
         except Exception as e:
             st.error(f"Error fetching meeting links: {str(e)}")
-            df['sales_no_meeting_links'] = pd.Series([False] * len(df), index=df.index)
+            df['sales_no_meeting_links'] = np.zeros(len(df), dtype=bool)
         
         # 7. Users with redundant sales + service seat combinations
         # Check if user has both sales and service seats
-        df['redundant_seat_combination'] = (
-            (df['hs_assigned_seats'].str.contains('sales', case=False, na=False)) &
-            (df['hs_assigned_seats'].str.contains('service', case=False, na=False))
-        )
+        df['redundant_seat_combination'] = has_sales & has_service
     
-    # Create priority columns
+    # Create priority columns (every flag column is plain bool by construction)
     df['high_priority_removal'] = df['inactive_30_plus_days'] | df['never_logged_in_after_invite']
     df['medium_priority_review'] = df['email_not_connected'] | df['calendar_not_connected']
     df['low_priority_review'] = (
@@ -313,28 +324,19 @@ def identify_underutilization(users_df, skip_low_priority=False):
     
     # Create overall underutilization score
     df['underutilization_score'] = (
-        df['high_priority_removal'].astype(int) * 3 +  # High priority = 3 points
-        df['medium_priority_review'].astype(int) * 2 +  # Medium priority = 2 points
-        df['low_priority_review'].astype(int) * 1  # Low priority = 1 point
+        df['high_priority_removal'].to_numpy() * 3 +  # High priority = 3 points
+        df['medium_priority_review'].to_numpy() * 2 +  # Medium priority = 2 points
+        df['low_priority_review'].to_numpy() * 1  # Low priority = 1 point
     )
     
-    # Create priority category
-    def get_priority_category(row):
-        if row['high_priority_removal']:
-            return '🔴 High Priority'
-        elif row['medium_priority_review']:
-            return '🟡 Medium Priority'
-        elif row['low_priority_review']:
-            return '🟢 Low Priority'
-        else:
-            return '✅ No Issues'
-    
-    df['priority_category'] = df.apply(get_priority_category, axis=1)
-    
-    # Ensure all placeholder columns are boolean Series
-    df['sales_no_meeting_links'] = df['sales_no_meeting_links'].astype(bool)
-    df['no_recent_engagements'] = df['no_recent_engagements'].astype(bool)
-    df['redundant_seat_combination'] = df['redundant_seat_combination'].astype(bool)
+    # Create priority category (first matching condition wins, highest priority first)
+    priority_conditions = [
+        df['high_priority_removal'].to_numpy(),
+        df['medium_priority_review'].to_numpy(),
+        df['low_priority_review'].to_numpy(),
+    ]
+    priority_choices = ['🔴 High Priority', '🟡 Medium Priority', '🟢 Low Priority']
+    df['priority_category'] = np.select(priority_conditions, priority_choices, default='✅ No Issues')
     
     return df
 
@@ -347,6 +349,16 @@ skip_low_priority = st.checkbox(
 # Add button to initiate analysis
 analyze_button = st.button("Analyze Cost Savings", type="primary")
 
+# Cached data and a stored result belong to the HubSpot key they were fetched with
+hubspot_key_hash = hash_api_key(st.session_state.get('hubspot_api_key', ''))
+
+# Users are cached for 10 minutes, engagements and meeting links for 15; allow forcing a
+# fresh pull of this key's data (the caches are shared, so other users' entries are kept)
+if st.button("Refresh data", help="Clear cached HubSpot data so the next analysis fetches it again."):
+    get_all_users.clear(hubspot_key_hash, st.session_state.get('hubspot_api_key', ''))
+    clear_fetch_caches(st.session_state.get('hubspot_api_key', ''), days_back=30)
+    st.info("Cached HubSpot data cleared. The next analysis will fetch fresh data.")
+
 if analyze_button:
     with st.spinner("Analyzing cost savings..."):
         status_text = st.empty()
@@ -354,7 +366,7 @@ if analyze_button:
         
         # Get all users only when button is pressed
         try:
-            users = get_all_users(st.session_state['hubspot_api_key'])
+            users = get_all_users(hubspot_key_hash, st.session_state['hubspot_api_key'])
             status_text.success(f"Successfully retrieved {len(users)} total users")
             
             # Convert to DataFrame for easier analysis using the clean function
@@ -363,15 +375,10 @@ if analyze_button:
             # Show filtering information
             total_users = len(users_df)
             deactivated_users = (users_df['hs_deactivated'] == 'true').sum()
-            users_with_sales_service_seats = users_df['hs_assigned_seats'].str.contains('sales|service', case=False, na=False).sum()
-            
-            st.info(f"""
-            **Filtering Summary:**
-            - Total users: {total_users}
-            - Deactivated users (excluded): {deactivated_users}
-            - Users with sales/service seats: {users_with_sales_service_seats}
-            - Users analyzed: {users_with_sales_service_seats - deactivated_users}
-            """)
+            seats = users_df['hs_assigned_seats'].fillna('').str.lower()
+            users_with_sales_service_seats = (
+                seats.str.contains('sales', regex=False) | seats.str.contains('service', regex=False)
+            ).sum()
             
             # Identify underutilization
             underutilized_users_df = identify_underutilization(users_df, skip_low_priority)
@@ -381,250 +388,254 @@ if analyze_button:
             portal_id = st.session_state.get('portal_id')
             
             if ui_domain and portal_id:
-                underutilized_users_df['User Link'] = underutilized_users_df['hs_internal_user_id'].apply(
-                    lambda x: f"https://{ui_domain}/settings/{portal_id}/users/user/{x}" if pd.notnull(x) else None
-                )
+                # Vectorized string concatenation; users without an internal ID get no link
+                user_ids = underutilized_users_df['hs_internal_user_id']
+                user_links = f"https://{ui_domain}/settings/{portal_id}/users/user/" + user_ids.astype('string')
+                underutilized_users_df['User Link'] = user_links.where(user_ids.notna(), None)
             else:
                 underutilized_users_df['User Link'] = None
             
-            # Display summary statistics
-            st.subheader("📊 Underutilization Summary")
+            # Keep the result so reruns (tab switches, table sorting, downloads) re-render
+            # it without re-running the analysis
+            st.session_state['cost_savings_result'] = {
+                'users': underutilized_users_df,
+                'skip_low_priority': skip_low_priority,
+                'filtering_summary': (total_users, deactivated_users, users_with_sales_service_seats),
+                'csv': analysis_to_csv(underutilized_users_df),
+                'api_key_hash': hubspot_key_hash,
+            }
             
-            col1, col2, col3, col4 = st.columns(4)
+        except Exception as e:
+            st.error(f"Error fetching users: {str(e)}")
+            st.session_state.pop('cost_savings_result', None)
+
+# Display the most recent analysis result, if any, unless the HubSpot key has changed since
+cost_savings_result = st.session_state.get('cost_savings_result')
+if cost_savings_result is not None and cost_savings_result['api_key_hash'] != hubspot_key_hash:
+    st.session_state.pop('cost_savings_result', None)
+    cost_savings_result = None
+if cost_savings_result is not None:
+    underutilized_users_df = cost_savings_result['users']
+    skip_low_priority = cost_savings_result['skip_low_priority']
+    total_users, deactivated_users, users_with_sales_service_seats = cost_savings_result['filtering_summary']
+    
+    st.info(f"""
+    **Filtering Summary:**
+    - Total users: {total_users}
+    - Deactivated users (excluded): {deactivated_users}
+    - Users with sales/service seats: {users_with_sales_service_seats}
+    - Users analyzed: {users_with_sales_service_seats - deactivated_users}
+    """)
+    
+    # Row positions for each priority category, computed in one pass and reused below
+    priority_groups = underutilized_users_df.groupby('priority_category', sort=False).indices
+    high_priority_rows = priority_groups.get('🔴 High Priority', np.array([], dtype=np.intp))
+    medium_priority_rows = priority_groups.get('🟡 Medium Priority', np.array([], dtype=np.intp))
+    low_priority_rows = priority_groups.get('🟢 Low Priority', np.array([], dtype=np.intp))
+    no_issues_rows = priority_groups.get('✅ No Issues', np.array([], dtype=np.intp))
+    
+    # Display summary statistics
+    st.subheader("📊 Underutilization Summary")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        high_priority_count = len(high_priority_rows)
+        st.metric("🔴 High Priority", high_priority_count)
+    
+    with col2:
+        medium_priority_count = len(medium_priority_rows)
+        st.metric("🟡 Medium Priority", medium_priority_count)
+    
+    with col3:
+        low_priority_count = len(low_priority_rows)
+        st.metric("🟢 Low Priority", low_priority_count)
+    
+    with col4:
+        no_issues_count = len(no_issues_rows)
+        st.metric("✅ No Issues", no_issues_count)
+    
+    # Display detailed breakdown
+    st.subheader("🔍 Detailed Underutilization Analysis")
+    
+    # Create tabs for detailed analysis
+    analysis_tab1, analysis_tab2, analysis_tab3, analysis_tab4 = st.tabs([
+        "🔴 High Priority", "🟡 Medium Priority", "🟢 Low Priority", "📋 Complete Analysis"
+    ])
+    
+    # High Priority Users Tab
+    with analysis_tab1:
+        if high_priority_count > 0:
+            st.markdown("### 🔴 High Priority Removal Targets")
             
+            col1, col2 = st.columns(2)
             with col1:
-                high_priority_count = (underutilized_users_df['priority_category'] == '🔴 High Priority').sum()
-                st.metric("🔴 High Priority", high_priority_count)
+                inactive_count = underutilized_users_df['inactive_30_plus_days'].iloc[high_priority_rows].sum()
+                st.metric("Inactive 30+ days", inactive_count)
             
             with col2:
-                medium_priority_count = (underutilized_users_df['priority_category'] == '🟡 Medium Priority').sum()
-                st.metric("🟡 Medium Priority", medium_priority_count)
+                never_logged_count = underutilized_users_df['never_logged_in_after_invite'].iloc[high_priority_rows].sum()
+                st.metric("Never logged in after invite", never_logged_count)
             
-            with col3:
-                low_priority_count = (underutilized_users_df['priority_category'] == '🟢 Low Priority').sum()
-                st.metric("🟢 Low Priority", low_priority_count)
+            # Select and rename columns for display
+            display_columns = {
+                'hs_searchable_calculated_name': 'Name',
+                'hs_email': 'Email',
+                'hs_last_activity_time': 'Last Login Date',
+                'hs_invite_accepted_time': 'Invite Accept Date',
+                'inactive_30_plus_days': '30+ Days Inactivity',
+                'never_logged_in_after_invite': '30+ Days Since Invite',
+                'User Link': 'User Link'
+            }
             
-            with col4:
-                no_issues_count = (underutilized_users_df['priority_category'] == '✅ No Issues').sum()
-                st.metric("✅ No Issues", no_issues_count)
+            # Project to this tab's rows and columns before doing any formatting
+            available_columns = {k: v for k, v in display_columns.items() if k in underutilized_users_df.columns}
+            high_priority_display = underutilized_users_df[list(available_columns)].iloc[high_priority_rows].rename(columns=available_columns)
             
-            # Display detailed breakdown
-            st.subheader("🔍 Detailed Underutilization Analysis")
+            # Format dates to YYYY-MM-DD (ISO date strings, without strftime's format parsing)
+            for date_column in ('Last Login Date', 'Invite Accept Date'):
+                if date_column in high_priority_display.columns:
+                    high_priority_display[date_column] = high_priority_display[date_column].dt.date.astype('string')
             
-            # Create tabs for detailed analysis
-            analysis_tab1, analysis_tab2, analysis_tab3, analysis_tab4 = st.tabs([
-                "🔴 High Priority", "🟡 Medium Priority", "🟢 Low Priority", "📋 Complete Analysis"
-            ])
-            
-            # High Priority Users Tab
-            with analysis_tab1:
-                if high_priority_count > 0:
-                    st.markdown("### 🔴 High Priority Removal Targets")
-                    high_priority_users = underutilized_users_df[underutilized_users_df['priority_category'] == '🔴 High Priority']
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        inactive_count = high_priority_users['inactive_30_plus_days'].sum()
-                        st.metric("Inactive 30+ days", inactive_count)
-                    
-                    with col2:
-                        never_logged_count = high_priority_users['never_logged_in_after_invite'].sum()
-                        st.metric("Never logged in after invite", never_logged_count)
-                    
-                    # Prepare high priority display with improved formatting
-                    high_priority_display = high_priority_users.copy()
-                    
-                    # Format dates to YYYY-MM-DD
-                    if 'hs_last_activity_time' in high_priority_display.columns:
-                        high_priority_display['Last Login Date'] = high_priority_display['hs_last_activity_time'].dt.strftime('%Y-%m-%d')
-                    else:
-                        high_priority_display['Last Login Date'] = None
-                        
-                    if 'hs_invite_accepted_time' in high_priority_display.columns:
-                        high_priority_display['Invite Accept Date'] = high_priority_display['hs_invite_accepted_time'].dt.strftime('%Y-%m-%d')
-                    else:
-                        high_priority_display['Invite Accept Date'] = None
-                    
-                    # Select and rename columns for display
-                    display_columns = {
-                        'hs_searchable_calculated_name': 'Name',
-                        'hs_email': 'Email',
-                        'Last Login Date': 'Last Login Date',
-                        'Invite Accept Date': 'Invite Accept Date',
-                        'inactive_30_plus_days': '30+ Days Inactivity',
-                        'never_logged_in_after_invite': '30+ Days Since Invite',
-                        'User Link': 'User Link'
-                    }
-                    
-                    # Filter to only include columns that exist
-                    available_columns = {k: v for k, v in display_columns.items() if k in high_priority_display.columns}
-                    high_priority_display = high_priority_display[list(available_columns.keys())].rename(columns=available_columns)
-                    
-                    # Display the table
-                    st.dataframe(
-                        high_priority_display, 
-                        use_container_width=True,
-                        column_config={
-                            "User Link": st.column_config.LinkColumn(
-                                display_text="User Link",
-                                help="Click to open user profile in HubSpot",
-                                max_chars=None,
-                                validate="^https://.*"
-                            )
-                        }
+            # Display the table
+            st.dataframe(
+                high_priority_display, 
+                use_container_width=True,
+                column_config={
+                    "User Link": st.column_config.LinkColumn(
+                        display_text="User Link",
+                        help="Click to open user profile in HubSpot",
+                        max_chars=None,
+                        validate="^https://.*"
                     )
-                else:
-                    st.info("✅ No high priority removal targets found.")
+                }
+            )
+        else:
+            st.info("✅ No high priority removal targets found.")
+    
+    # Medium Priority Users Tab
+    with analysis_tab2:
+        if medium_priority_count > 0:
+            st.markdown("### 🟡 Medium Priority Review")
             
-            # Medium Priority Users Tab
-            with analysis_tab2:
-                if medium_priority_count > 0:
-                    st.markdown("### 🟡 Medium Priority Review")
-                    medium_priority_users = underutilized_users_df[underutilized_users_df['priority_category'] == '🟡 Medium Priority']
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        email_not_connected_count = medium_priority_users['email_not_connected'].sum()
-                        st.metric("Email not connected", email_not_connected_count)
-                    
-                    with col2:
-                        calendar_not_connected_count = medium_priority_users['calendar_not_connected'].sum()
-                        st.metric("Calendar not connected", calendar_not_connected_count)
-                    
-                    # Prepare medium priority display with improved formatting
-                    medium_priority_display = medium_priority_users.copy()
-                    
-                    # Select and rename columns for display
-                    display_columns = {
-                        'hs_searchable_calculated_name': 'Name',
-                        'hs_email': 'Email',
-                        'hs_connected_email_status': 'Email Status',
-                        'hs_calendar_connection_status': 'Calendar Status',
-                        'email_not_connected': 'Email Not Connected',
-                        'calendar_not_connected': 'Calendar Not Connected',
-                        'User Link': 'User Link'
-                    }
-                    
-                    # Filter to only include columns that exist
-                    available_columns = {k: v for k, v in display_columns.items() if k in medium_priority_display.columns}
-                    medium_priority_display = medium_priority_display[list(available_columns.keys())].rename(columns=available_columns)
-                    
-                    # Display the table
-                    st.dataframe(
-                        medium_priority_display, 
-                        use_container_width=True,
-                        column_config={
-                            "User Link": st.column_config.LinkColumn(
-                                display_text="User Link",
-                                help="Click to open user profile in HubSpot",
-                                max_chars=None,
-                                validate="^https://.*"
-                            )
-                        }
-                    )
-                else:
-                    st.info("✅ No medium priority review targets found.")
+            col1, col2 = st.columns(2)
+            with col1:
+                email_not_connected_count = underutilized_users_df['email_not_connected'].iloc[medium_priority_rows].sum()
+                st.metric("Email not connected", email_not_connected_count)
+            
+            with col2:
+                calendar_not_connected_count = underutilized_users_df['calendar_not_connected'].iloc[medium_priority_rows].sum()
+                st.metric("Calendar not connected", calendar_not_connected_count)
+            
+            # Select and rename columns for display
+            display_columns = {
+                'hs_searchable_calculated_name': 'Name',
+                'hs_email': 'Email',
+                'hs_connected_email_status': 'Email Status',
+                'hs_calendar_connection_status': 'Calendar Status',
+                'email_not_connected': 'Email Not Connected',
+                'calendar_not_connected': 'Calendar Not Connected',
+                'User Link': 'User Link'
+            }
+            
+            # Filter to only include columns that exist
+            available_columns = {k: v for k, v in display_columns.items() if k in underutilized_users_df.columns}
+            medium_priority_display = underutilized_users_df[list(available_columns)].iloc[medium_priority_rows].rename(columns=available_columns)
             
-            # Low Priority Users Tab
-            with analysis_tab3:
-                if low_priority_count > 0 and not skip_low_priority:
-                    st.markdown("### 🟢 Low Priority Review")
-                    low_priority_users = underutilized_users_df[underutilized_users_df['priority_category'] == '🟢 Low Priority']
-                    
-                    # Prepare low priority display with improved formatting
-                    low_priority_display = low_priority_users.copy()
-                    
-                    # Select and rename columns for display
-                    display_columns = {
-                        'hs_searchable_calculated_name': 'Name',
-                        'hs_email': 'Email',
-                        'no_recent_engagements': 'No Recent Engagements',
-                        'sales_no_meeting_links': 'No Meeting Links',
-                        'redundant_seat_combination': 'Redundant Seat Combination',
-                        'User Link': 'User Link'
-                    }
-                    
-                    # Filter to only include columns that exist
-                    available_columns = {k: v for k, v in display_columns.items() if k in low_priority_display.columns}
-                    low_priority_display = low_priority_display[list(available_columns.keys())].rename(columns=available_columns)
-                    
-                    # Display the table
-                    st.dataframe(
-                        low_priority_display, 
-                        use_container_width=True,
-                        column_config={
-                            "User Link": st.column_config.LinkColumn(
-                                display_text="User Link",
-                                help="Click to open user profile in HubSpot",
-                                max_chars=None,
-                                validate="^https://.*"
-                            )
-                        }
+            # Display the table
+            st.dataframe(
+                medium_priority_display, 
+                use_container_width=True,
+                column_config={
+                    "User Link": st.column_config.LinkColumn(
+                        display_text="User Link",
+                        help="Click to open user profile in HubSpot",
+                        max_chars=None,
+                        validate="^https://.*"
                     )
-                elif skip_low_priority:
-                    st.info("🟢 Low Priority Review was skipped for faster analysis. Uncheck the 'Skip low priority review' option to include this analysis.")
-                else:
-                    st.info("✅ No low priority review targets found.")
+                }
+            )
+        else:
+            st.info("✅ No medium priority review targets found.")
+    
+    # Low Priority Users Tab
+    with analysis_tab3:
+        if low_priority_count > 0 and not skip_low_priority:
+            st.markdown("### 🟢 Low Priority Review")
             
-            # Complete Analysis Tab
-            with analysis_tab4:
-                st.markdown("### 📋 Complete Analysis Table")
-                
-                # Prepare complete analysis display with improved formatting
-                complete_display = underutilized_users_df.copy()
-                
-                # Format dates to YYYY-MM-DD
-                if 'hs_last_activity_time' in complete_display.columns:
-                    complete_display['Last Login Date'] = complete_display['hs_last_activity_time'].dt.strftime('%Y-%m-%d')
-                else:
-                    complete_display['Last Login Date'] = None
-                    
-                if 'hs_invite_accepted_time' in complete_display.columns:
-                    complete_display['Invite Accept Date'] = complete_display['hs_invite_accepted_time'].dt.strftime('%Y-%m-%d')
-                else:
-                    complete_display['Invite Accept Date'] = None
-                
-                # Select and rename columns for display - include all detailed columns
-                display_columns = {
-                    'hs_searchable_calculated_name': 'Name',
-                    'hs_email': 'Email',
-                    'priority_category': 'Priority Category',
-                    'inactive_30_plus_days': '30+ Days Inactivity',
-                    'never_logged_in_after_invite': '30+ Days Since Invite',
-                    'email_not_connected': 'Email Not Connected',
-                    'calendar_not_connected': 'Calendar Not Connected',
-                    'no_recent_engagements': 'No Recent Engagements',
-                    'sales_no_meeting_links': 'No Meeting Links',
-                    'redundant_seat_combination': 'Redundant Seat Combination',
-                    'User Link': 'User Link'
+            # Select and rename columns for display
+            display_columns = {
+                'hs_searchable_calculated_name': 'Name',
+                'hs_email': 'Email',
+                'no_recent_engagements': 'No Recent Engagements',
+                'sales_no_meeting_links': 'No Meeting Links',
+                'redundant_seat_combination': 'Redundant Seat Combination',
+                'User Link': 'User Link'
+            }
+            
+            # Filter to only include columns that exist
+            available_columns = {k: v for k, v in display_columns.items() if k in underutilized_users_df.columns}
+            low_priority_display = underutilized_users_df[list(available_columns)].iloc[low_priority_rows].rename(columns=available_columns)
+            
+            # Display the table
+            st.dataframe(
+                low_priority_display, 
+                use_container_width=True,
+                column_config={
+                    "User Link": st.column_config.LinkColumn(
+                        display_text="User Link",
+                        help="Click to open user profile in HubSpot",
+                        max_chars=None,
+                        validate="^https://.*"
+                    )
                 }
-                
-                # Filter to only include columns that exist
-                available_columns = {k: v for k, v in display_columns.items() if k in complete_display.columns}
-                complete_display = complete_display[list(available_columns.keys())].rename(columns=available_columns)
-                
-                # Display the table
-                st.dataframe(
-                    complete_display, 
-                    use_container_width=True,
-                    column_config={
-                        "User Link": st.column_config.LinkColumn(
-                            display_text="User Link",
-                            help="Click to open user profile in HubSpot",
-                            max_chars=None,
-                            validate="^https://.*"
-                        )
-                    }
-                )
-                
-                # Download option
-                csv = underutilized_users_df.to_csv(index=False)  # type: ignore
-                st.download_button(
-                    label="📥 Download Complete Analysis as CSV",
-                    data=csv,
-                    file_name=f"hubspot_cost_savings_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
+            )
+        elif skip_low_priority:
+            st.info("🟢 Low Priority Review was skipped for faster analysis. Uncheck the 'Skip low priority review' option to include this analysis.")
+        else:
+            st.info("✅ No low priority review targets found.")
+    
+    # Complete Analysis Tab
+    with analysis_tab4:
+        st.markdown("### 📋 Complete Analysis Table")
+        
+        # Select and rename columns for display - include all detailed columns
+        display_columns = {
+            'hs_searchable_calculated_name': 'Name',
+            'hs_email': 'Email',
+            'priority_category': 'Priority Category',
+            'inactive_30_plus_days': '30+ Days Inactivity',
+            'never_logged_in_after_invite': '30+ Days Since Invite',
+            'email_not_connected': 'Email Not Connected',
+            'calendar_not_connected': 'Calendar Not Connected',
+            'no_recent_engagements': 'No Recent Engagements',
+            'sales_no_meeting_links': 'No Meeting Links',
+            'redundant_seat_combination': 'Redundant Seat Combination',
+            'User Link': 'User Link'
+        }
+        
+        # Filter to only include columns that exist
+        available_columns = {k: v for k, v in display_columns.items() if k in underutilized_users_df.columns}
+        complete_display = underutilized_users_df.loc[:, list(available_columns)].rename(columns=available_columns)
+        
+        # Display the table
+        st.dataframe(
+            complete_display, 
+            use_container_width=True,
+            column_config={
+                "User Link": st.column_config.LinkColumn(
+                    display_text="User Link",
+                    help="Click to open user profile in HubSpot",
+                    max_chars=None,
+                    validate="^https://.*"
                 )
-            
-        except Exception as e:
-            st.error(f"Error fetching users: {str(e)}")
+            }
+        )
+        
+        # Download option
+        st.download_button(
+            label="📥 Download Complete Analysis as CSV",
+            data=cost_savings_result['csv'],
+            file_name=f"hubspot_cost_savings_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv"
+        )
@@ -1,5 +1,8 @@
 import streamlit as st
 
+# Rendered as a fragment so the sidebar's own button only reruns the sidebar,
+# not the page it is embedded in.
+@st.fragment
 def render_sidebar():
 
     st.title("🔑 API Configuration Status")
@@ -1,13 +1,286 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
-from typing import List, Dict, Any, Optional
+from typing import TYPE_CHECKING, Iterator, List, Dict, Any, Optional
 from datetime import datetime, timedelta
 
+# The OpenAI SDK is slow to import and only needed to check the OpenAI key, so it is
+# imported inside those helpers instead of whenever a page imports utils
+if TYPE_CHECKING:
+    import openai
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
+
+
+def _decode_json(response: requests.Response) -> Any:
+    # Decode the raw bytes directly (orjson when installed), skipping requests' encoding
+    # detection. Decode errors are re-raised as a RequestException, as response.json()
+    # would, so callers' request error handling still covers a non-JSON body.
+    try:
+        return _json_loads(response.content)
+    except ValueError as e:
+        raise requests.exceptions.InvalidJSONError(f"Invalid JSON in response from {response.url}: {e}", response=response) from e
+
+
+class _RateLimitedAdapter(HTTPAdapter):
+    """
+    HTTPS adapter that spaces requests out with a token bucket per access token.
+    
+    HubSpot allows about 10 requests per second per app; staying just under that avoids
+    429s, which cost a backoff each and can lower the account's limits. Each token gets
+    its own bucket, so users of the shared session don't throttle one another. Bursts up
+    to `rate` requests go straight through; beyond that each request waits for its slot.
+    
+    Rate-limit (429) and transient 5xx responses are retried here rather than by urllib3,
+    so every retry also takes a token: it waits out HubSpot's Retry-After header (or a
+    0.5s, 1s, 2s backoff) and then its slot in the bucket.
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    MAX_BUCKETS = 64
+
+    def __init__(self, rate: float = 9, status_retries: int = 3, backoff: float = 0.5, **kwargs):
+        self._rate = rate
+        self._status_retries = status_retries
+        self._backoff = backoff
+        # Token hash -> [tokens, last refill time], least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def _acquire(self, key: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.pop(key, None) or [self._rate, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+            tokens = min(self._rate, bucket[0] + (now - bucket[1]) * self._rate)
+            # Going negative reserves a future slot, so concurrent callers queue up in order
+            tokens -= 1
+            bucket[0], bucket[1] = tokens, now
+            wait = -tokens / self._rate if tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def send(self, request, **kwargs):
+        key = hash_api_key(request.headers.get('authorization', ''))
+        for attempt in range(self._status_retries + 1):
+            self._acquire(key)
+            response = super().send(request, **kwargs)
+            if response.status_code not in self.RETRY_STATUSES or attempt == self._status_retries:
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.isdigit() else self._backoff * 2 ** attempt
+            response.close()
+            time.sleep(delay)
+
+
+@st.cache_resource
+def get_hubspot_session() -> requests.Session:
+    """
+    Get a shared HTTP session for HubSpot REST calls.
+    
+    Reusing one session keeps connections alive, so TCP/TLS setup is paid once
+    instead of on every request. Requests are throttled to 9 per second per access
+    token, and any rate-limit (429) or transient 5xx responses are still retried with
+    backoff, honouring HubSpot's Retry-After header.
+    
+    The session is shared by every user of the app: pass per-user values such as the
+    authorization header per request, never via session.headers.
+    
+    Returns:
+        requests.Session: Cached session with a pooled, throttled, retrying HTTPS adapter
+    """
+    # urllib3 only retries connection errors; status retries go through the adapter's bucket
+    retry = Retry(total=3, backoff_factor=0.5)
+    session = requests.Session()
+    session.mount("https://", _RateLimitedAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry))
+    session.headers.update({'accept': "application/json"})
+    return session
+
+
+@st.cache_resource(ttl=3600, max_entries=16)
+def get_openai_client(api_key_hash: str, _api_key: str) -> "openai.OpenAI":
+    """
+    Get an OpenAI client for the given API key, shared across reruns and pages for an hour.
+    
+    The instance is shared by every session using this key, so don't mutate it
+    (use with_options() for per-call settings).
+    
+    Args:
+        api_key_hash (str): Hash of the key from hash_api_key, used as the cache key
+        _api_key (str): OpenAI API key (underscore-prefixed so Streamlit does not hash it)
+    
+    Returns:
+        openai.OpenAI: Cached OpenAI client (a new key creates a new client)
+    """
+    import openai
+    return openai.OpenAI(api_key=_api_key)
+
+
+def hash_api_key(api_key: str) -> str:
+    """
+    Hash an API key for use as a cache key, so the raw key is never hashed or logged by the cache.
+    
+    Args:
+        api_key (str): API key to hash
+    
+    Returns:
+        str: Hex SHA-256 digest of the key
+    """
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def check_openai_api_key(api_key_hash: str, _api_key: str) -> bool:
+    """
+    Check whether an OpenAI API key is valid, cached for an hour per key.
+    
+    Args:
+        api_key_hash (str): Hash of the key from hash_api_key, used as the cache key
+        _api_key (str): OpenAI API key (underscore-prefixed so Streamlit does not hash it)
+    
+    Returns:
+        bool: False if OpenAI rejects the key, True otherwise
+        
+    Raises:
+        openai.APIError: If OpenAI cannot be reached (e.g. timeout); not cached
+    """
+    import openai
+    try:
+        # Fail fast: no retries and a short timeout instead of the SDK defaults.
+        # A single model lookup is much cheaper than listing every model.
+        client = get_openai_client(api_key_hash, _api_key).with_options(max_retries=0, timeout=5.0)
+        client.models.retrieve("gpt-4o-mini")
+    except openai.AuthenticationError:
+        return False
+    except openai.NotFoundError:
+        # The key authenticated; it just has no access to this particular model
+        return True
+    else:
+        return True
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_account_details(api_key_hash: str, _hubspot_api_key: str) -> Dict[str, Any]:
+    """
+    Fetch HubSpot account details (uiDomain, portalId, ...), cached for an hour per token.
+    
+    Args:
+        api_key_hash (str): Hash of the token from hash_api_key, used as the cache key
+        _hubspot_api_key (str): HubSpot API access token (underscore-prefixed so Streamlit does not hash it)
+    
+    Returns:
+        Dict[str, Any]: Account details from the account-info API
+        
+    Raises:
+        requests.exceptions.RequestException: If API request fails
+    """
+    url = "https://api.hubapi.com/account-info/v3/details"
+    headers = {'authorization': f"Bearer {_hubspot_api_key}"}
+    response = get_hubspot_session().get(url, headers=headers, timeout=30)
+    response.raise_for_status()
+    return _decode_json(response)
+
+
+MEETING_LINKS_URL = "https://api.hubapi.com/scheduler/v3/meetings/meeting-links"
+ENGAGEMENTS_URL = "https://api.hubapi.com/engagements/v1/engagements/paged"
+
+
+def _paginate(url: str, hubspot_api_key: str, limit: int, cursor: str) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield the results of each page of a paged HubSpot endpoint, up to the last page.
+    
+    Args:
+        url (str): Endpoint URL
+        hubspot_api_key (str): HubSpot API access token
+        limit (int): Number of results per page
+        cursor (str): "after" for endpoints paged via paging.next.after,
+            "offset" for endpoints paged via hasMore/offset
+    
+    Yields:
+        List[Dict[str, Any]]: Results of one page
+        
+    Raises:
+        requests.exceptions.RequestException: If API request fails
+    """
+    # Everything but the cursor is the same for every page, so build it once
+    session = get_hubspot_session()
+    headers = {'authorization': f"Bearer {hubspot_api_key}"}
+    params = {"limit": str(limit)}
+    
+    while True:
+        response = session.get(url, headers=headers, params=params, timeout=30)
+        response.raise_for_status()
+        data = _decode_json(response)
+        
+        yield data.get('results', [])
+        
+        # Check for pagination
+        if cursor == "after":
+            next_cursor = data.get('paging', {}).get('next', {}).get('after')
+        else:
+            next_cursor = data.get('offset') if data.get('hasMore', False) else None
+        if not next_cursor:
+            # No more pages
+            break
+        params[cursor] = str(next_cursor)
+
+
+def _created_at(engagement: Dict[str, Any]) -> int:
+    return engagement.get('engagement', {}).get('createdAt', 0)
+
+
+def _within_cutoff(engagements: List[Dict[str, Any]], cutoff_timestamp: int) -> List[Dict[str, Any]]:
+    # Engagements come newest first: if the oldest one on the page is in the window, all of
+    # them are, so only the page that crosses the cutoff needs a (binary) search
+    if not engagements or _created_at(engagements[-1]) >= cutoff_timestamp:
+        return engagements
+    # Find the first engagement older than the cutoff (bisect's key= needs Python 3.10+)
+    lo, hi = 0, len(engagements) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _created_at(engagements[mid]) < cutoff_timestamp:
+            hi = mid
+        else:
+            lo = mid + 1
+    return engagements[:lo]
+
+
+def clear_fetch_caches(hubspot_api_key: str, days_back: int = 30) -> None:
+    """
+    Drop one token's cached meeting links and engagements so its next fetch goes back to HubSpot.
+    
+    The caches are shared by every session, so only this token's entries (at the default
+    page sizes) are cleared; other users keep theirs.
+    
+    Args:
+        hubspot_api_key (str): HubSpot API access token
+        days_back (int): Engagement window whose cache entry to clear (default 30)
+    """
+    api_key_hash = hash_api_key(hubspot_api_key)
+    _fetch_meeting_links.clear(api_key_hash, hubspot_api_key, 100)
+    _fetch_engagements.clear(api_key_hash, hubspot_api_key, 250, days_back)
+
 
 def get_all_meeting_links(hubspot_api_key: str, limit: int = 100) -> List[Dict[str, Any]]:
     """
     Fetch all meeting links from HubSpot API with pagination support.
     
+    Results are cached for 15 minutes per token and page size, so reruns don't re-page
+    HubSpot. Each call gets its own copy of the cached list, so callers may mutate it.
+    
     Args:
         hubspot_api_key (str): HubSpot API access token
         limit (int): Number of results per page (max 100)
@@ -18,49 +291,36 @@ def get_all_meeting_links(hubspot_api_key: str, limit: int = 100) -> List[Dict[s
     Raises:
         requests.exceptions.RequestException: If API request fails
     """
-    all_meeting_links = []
-    after = None
+    return _fetch_meeting_links(hash_api_key(hubspot_api_key), hubspot_api_key, limit)
+
+
+@st.cache_data(ttl=900, max_entries=8, show_spinner=False)
+def _fetch_meeting_links(api_key_hash: str, _hubspot_api_key: str, limit: int) -> List[Dict[str, Any]]:
+    try:
+        return list(iter_meeting_links(_hubspot_api_key, limit))
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error fetching meeting links: {str(e)}")
+        raise e
+
+
+def iter_meeting_links(hubspot_api_key: str, limit: int = 100) -> Iterator[Dict[str, Any]]:
+    """
+    Stream meeting links from HubSpot API, yielding each one as soon as its page arrives.
     
-    while True:
-        # Prepare the request
-        url = "https://api.hubapi.com/scheduler/v3/meetings/meeting-links"
-        headers = {
-            'accept': "application/json",
-            'authorization': f"Bearer {hubspot_api_key}"
-        }
-        
-        # Build query parameters
-        params = {"limit": str(limit)}
-        if after:
-            params["after"] = after
-        
-        try:
-            # Make the API request
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            # Parse the response
-            data = response.json()
-            
-            # Add results to our collection
-            if 'results' in data:
-                all_meeting_links.extend(data['results'])
-            
-            # Check for pagination
-            paging = data.get('paging', {})
-            next_page = paging.get('next', {})
-            
-            if next_page and 'after' in next_page:
-                after = next_page['after']
-            else:
-                # No more pages
-                break
-                
-        except requests.exceptions.RequestException as e:
-            st.error(f"Error fetching meeting links: {str(e)}")
-            raise e
+    Not cached: use this to process links page by page without holding them all in memory.
     
-    return all_meeting_links
+    Args:
+        hubspot_api_key (str): HubSpot API access token
+        limit (int): Number of results per page (max 100)
+    
+    Yields:
+        Dict[str, Any]: Meeting link object
+        
+    Raises:
+        requests.exceptions.RequestException: If API request fails
+    """
+    for results in _paginate(MEETING_LINKS_URL, hubspot_api_key, limit, "after"):
+        yield from results
 
 
 def get_meeting_links_with_progress(hubspot_api_key: str, limit: int = 100) -> List[Dict[str, Any]]:
@@ -75,60 +335,21 @@ def get_meeting_links_with_progress(hubspot_api_key: str, limit: int = 100) -> L
         List[Dict[str, Any]]: List of all meeting link objects
     """
     all_meeting_links = []
-    after = None
     page_count = 0
     
-    # Create a progress bar
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    while True:
-        page_count += 1
-        status_text.text(f"Fetching page {page_count}...")
-        
-        # Prepare the request
-        url = "https://api.hubapi.com/scheduler/v3/meetings/meeting-links"
-        headers = {
-            'accept': "application/json",
-            'authorization': f"Bearer {hubspot_api_key}"
-        }
-        
-        # Build query parameters
-        params = {"limit": str(limit)}
-        if after:
-            params["after"] = after
-        
+    # One collapsed status container, relabelled in place as pages arrive
+    with st.status("Fetching meeting links...", expanded=False) as status:
         try:
-            # Make the API request
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            # Parse the response
-            data = response.json()
-            
-            # Add results to our collection
-            if 'results' in data:
-                all_meeting_links.extend(data['results'])
-                st.write(f"Retrieved {len(data['results'])} meeting links from page {page_count}")
-            
-            # Check for pagination
-            paging = data.get('paging', {})
-            next_page = paging.get('next', {})
-            
-            if next_page and 'after' in next_page:
-                after = next_page['after']
-                # Update progress (assuming we don't know total pages, just show we're working)
-                progress_bar.progress(min(0.9, page_count * 0.1))
-            else:
-                # No more pages
-                progress_bar.progress(1.0)
-                status_text.text(f"Completed! Retrieved {len(all_meeting_links)} total meeting links from {page_count} pages.")
-                break
-                
+            for results in _paginate(MEETING_LINKS_URL, hubspot_api_key, limit, "after"):
+                page_count += 1
+                all_meeting_links.extend(results)
+                status.update(label=f"Fetching meeting links: page {page_count}, {len(all_meeting_links)} so far...")
         except requests.exceptions.RequestException as e:
-            st.error(f"Error fetching meeting links on page {page_count}: {str(e)}")
+            status.update(label="Fetching meeting links failed", state="error", expanded=True)
+            st.error(f"Error fetching meeting links on page {page_count + 1}: {str(e)}")
             raise e
-    
+        
+        status.update(label=f"Completed! Retrieved {len(all_meeting_links)} total meeting links from {page_count} pages.", state="complete")
     return all_meeting_links
 
 
@@ -136,6 +357,9 @@ def get_all_engagements(hubspot_api_key: str, limit: int = 250, days_back: int =
     """
     Fetch all engagements from HubSpot API with pagination support and date filtering.
     
+    Results are cached for 15 minutes per token, page size and window, so reruns don't
+    re-page HubSpot. Each call gets its own copy of the cached list, so callers may mutate it.
+    
     Args:
         hubspot_api_key (str): HubSpot API access token
         limit (int): Number of results per page (max 250)
@@ -147,62 +371,44 @@ def get_all_engagements(hubspot_api_key: str, limit: int = 250, days_back: int =
     Raises:
         requests.exceptions.RequestException: If API request fails
     """
-    all_engagements = []
-    offset = None
-    cutoff_timestamp = int((datetime.now() - timedelta(days=days_back)).timestamp() * 1000)
+    return _fetch_engagements(hash_api_key(hubspot_api_key), hubspot_api_key, limit, days_back)
+
+
+@st.cache_data(ttl=900, max_entries=8, show_spinner=False)
+def _fetch_engagements(api_key_hash: str, _hubspot_api_key: str, limit: int, days_back: int) -> List[Dict[str, Any]]:
+    try:
+        return list(iter_engagements(_hubspot_api_key, limit, days_back))
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error fetching engagements: {str(e)}")
+        raise e
+
+
+def iter_engagements(hubspot_api_key: str, limit: int = 250, days_back: int = 30) -> Iterator[Dict[str, Any]]:
+    """
+    Stream engagements from HubSpot API newest first, stopping at the date cutoff.
     
-    while True:
-        # Prepare the request
-        url = "https://api.hubapi.com/engagements/v1/engagements/paged"
-        headers = {
-            'accept': "application/json",
-            'authorization': f"Bearer {hubspot_api_key}"
-        }
-        
-        # Build query parameters
-        params = {"limit": str(limit)}
-        if offset:
-            params["offset"] = str(offset)
+    Not cached: use this to process engagements page by page without holding them all in memory.
+    
+    Args:
+        hubspot_api_key (str): HubSpot API access token
+        limit (int): Number of results per page (max 250)
+        days_back (int): Number of days back to fetch engagements (default 30)
+    
+    Yields:
+        Dict[str, Any]: Engagement object
         
-        try:
-            # Make the API request
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            # Parse the response
-            data = response.json()
-            
-            # Add results to our collection
-            if 'results' in data:
-                # Filter engagements by creation date
-                filtered_results = []
-                for engagement in data['results']:
-                    engagement_data = engagement.get('engagement', {})
-                    created_at = engagement_data.get('createdAt', 0)
-                    
-                    # Stop if we've reached engagements older than our cutoff
-                    if created_at < cutoff_timestamp:
-                        return all_engagements
-                    
-                    filtered_results.append(engagement)
-                
-                all_engagements.extend(filtered_results)
-            
-            # Check for pagination
-            has_more = data.get('hasMore', False)
-            if has_more:
-                offset = data.get('offset')
-                if not offset:
-                    break
-            else:
-                # No more pages
-                break
-                
-        except requests.exceptions.RequestException as e:
-            st.error(f"Error fetching engagements: {str(e)}")
-            raise e
+    Raises:
+        requests.exceptions.RequestException: If API request fails
+    """
+    cutoff_timestamp = int((datetime.now() - timedelta(days=days_back)).timestamp() * 1000)
     
-    return all_engagements
+    for results in _paginate(ENGAGEMENTS_URL, hubspot_api_key, limit, "offset"):
+        recent = _within_cutoff(results, cutoff_timestamp)
+        yield from recent
+        
+        # Stop once we've reached engagements older than our cutoff
+        if len(recent) < len(results):
+            return
 
 
 def get_engagements_with_progress(hubspot_api_key: str, limit: int = 250, days_back: int = 30) -> List[Dict[str, Any]]:
@@ -218,74 +424,30 @@ def get_engagements_with_progress(hubspot_api_key: str, limit: int = 250, days_b
         List[Dict[str, Any]]: List of all engagement objects
     """
     all_engagements = []
-    offset = None
     page_count = 0
     cutoff_timestamp = int((datetime.now() - timedelta(days=days_back)).timestamp() * 1000)
+    reached_cutoff = False
     
-    # Create a progress bar
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    while True:
-        page_count += 1
-        status_text.text(f"Fetching engagements page {page_count}...")
-        
-        # Prepare the request
-        url = "https://api.hubapi.com/engagements/v1/engagements/paged"
-        headers = {
-            'accept': "application/json",
-            'authorization': f"Bearer {hubspot_api_key}"
-        }
-        
-        # Build query parameters
-        params = {"limit": str(limit)}
-        if offset:
-            params["offset"] = str(offset)
-        
+    # One collapsed status container, relabelled in place as pages arrive
+    with st.status("Fetching engagements...", expanded=False) as status:
         try:
-            # Make the API request
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            # Parse the response
-            data = response.json()
-            
-            # Add results to our collection
-            if 'results' in data:
-                # Filter engagements by creation date
-                filtered_results = []
-                for engagement in data['results']:
-                    engagement_data = engagement.get('engagement', {})
-                    created_at = engagement_data.get('createdAt', 0)
-                    
-                    # Stop if we've reached engagements older than our cutoff
-                    if created_at < cutoff_timestamp:
-                        progress_bar.progress(1.0)
-                        status_text.text(f"Completed! Retrieved {len(all_engagements)} total engagements from {page_count} pages (stopped at {days_back} days back).")
-                        return all_engagements
-                    
-                    filtered_results.append(engagement)
+            for results in _paginate(ENGAGEMENTS_URL, hubspot_api_key, limit, "offset"):
+                page_count += 1
+                recent = _within_cutoff(results, cutoff_timestamp)
+                all_engagements.extend(recent)
                 
-                all_engagements.extend(filtered_results)
-                st.write(f"Retrieved {len(filtered_results)} engagements from page {page_count}")
-            
-            # Check for pagination
-            has_more = data.get('hasMore', False)
-            if has_more:
-                offset = data.get('offset')
-                if not offset:
+                # Stop once we've reached engagements older than our cutoff
+                if len(recent) < len(results):
+                    reached_cutoff = True
                     break
-                # Update progress (assuming we don't know total pages, just show we're working)
-                progress_bar.progress(min(0.9, page_count * 0.1))
-            else:
-                # No more pages
-                progress_bar.progress(1.0)
-                status_text.text(f"Completed! Retrieved {len(all_engagements)} total engagements from {page_count} pages.")
-                break
                 
+                status.update(label=f"Fetching engagements: page {page_count}, {len(all_engagements)} so far...")
         except requests.exceptions.RequestException as e:
-            st.error(f"Error fetching engagements on page {page_count}: {str(e)}")
+            status.update(label="Fetching engagements failed", state="error", expanded=True)
+            st.error(f"Error fetching engagements on page {page_count + 1}: {str(e)}")
             raise e
-    
+        
+        stopped_at = f" (stopped at {days_back} days back)" if reached_cutoff else ""
+        status.update(label=f"Completed! Retrieved {len(all_engagements)} total engagements from {page_count} pages{stopped_at}.", state="complete")
     return all_engagements
 